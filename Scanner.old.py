@@ -9,20 +9,30 @@ from PIL import Image
 import os
 import logging
 
+_PO_RE = re.compile(r'PO\d+')
+OCR_CONFIG = '--psm 11 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+def _extract_po_from_pil(image):
+    """
+    Extracts the Purchase Order (PO) number from an already-loaded PIL image using OCR.
+    """
+    # Use Tesseract OCR to extract text from the image
+    ocr_result = pytesseract.image_to_string(image, config=OCR_CONFIG)
+
+    # Use regex to search for PO patterns, e.g., 'PO12345'
+    po_number_match = _PO_RE.search(ocr_result)
+    return po_number_match.group() if po_number_match else None
+
 def extract_po_number_from_image(image_path):
     """
     Extracts the Purchase Order (PO) number from a PNG image using OCR.
     """
     try:
-        # Use Tesseract OCR to extract text from the image
-        ocr_result = pytesseract.image_to_string(Image.open(image_path))
-
-        # Use regex to search for PO patterns, e.g., 'PO12345'
-        po_number_match = re.search(r'PO\d+', ocr_result)
+        po_number = _extract_po_from_pil(Image.open(image_path))
 
-        if po_number_match:
-            logging.info(f"PO Number '{po_number_match.group()}' found in image: {image_path}")
-            return po_number_match.group()
+        if po_number:
+            logging.info(f"PO Number '{po_number}' found in image: {image_path}")
+            return po_number
         else:
             logging.warning(f"No PO Number found in image: {image_path}")
             return None
@@ -35,20 +45,14 @@ def extract_po_number_from_pdf(pdf_path):
     Extracts the Purchase Order (PO) number from a PDF file using OCR.
     """
     try:
-        # Convert PDF pages to images
-        pages = convert_from_path(pdf_path)
+        # Convert PDF pages to images (JPEG rasterizes faster than the default PPM)
+        pages = convert_from_path(pdf_path, fmt='jpeg', thread_count=os.cpu_count())
         for page_number, page in enumerate(pages, start=1):
-            # Save page as a temporary PNG image
-            temp_image_path = f"temp_page_{page_number}.png"
-            page.save(temp_image_path, "PNG")
-
-            # Use OCR to extract text from the image of the page
-            po_number = extract_po_number_from_image(temp_image_path)
-
-            # Cleanup temporary file
-            os.remove(temp_image_path)
+            # OCR the rendered page directly, no need to round-trip it through a temp file
+            po_number = _extract_po_from_pil(page)
 
             if po_number:
+                logging.info(f"PO Number '{po_number}' found on page {page_number} of PDF: {pdf_path}")
                 return po_number
 
         logging.warning(f"No PO Number found in any page of the PDF: {pdf_path}")
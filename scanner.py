@@ -1,19 +1,59 @@
 import re
-import pytesseract
+from tesserocr import PyTessBaseAPI, PSM
 from PIL import Image
+from PIL import ImageOps
 import os
 import logging
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import PatternMatchingEventHandler
 import time
-import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from secrets import token_hex
 import shutil
+import errno
 import argparse
 import sys
+import io
+import hashlib
+from collections import OrderedDict
+
+try:  # Optional: compiled binarization kernel, falls back to PIL when unavailable
+    import numpy as np
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:  # Optional: DFA-based PO search, there are no hyperscan wheels for Windows so re is used there
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+_PO_PATTERN = r'PO\d+'  # "PO" followed by numbers
+_PO_RE = re.compile(_PO_PATTERN)
+_PO_BYTES_RE = re.compile(_PO_PATTERN.encode())
+if hyperscan is not None:
+    _PO_DB = hyperscan.Database()
+    _PO_DB.compile(expressions=[_PO_PATTERN.encode()], flags=[hyperscan.HS_FLAG_SOM_LEFTMOST])
+else:
+    _PO_DB = None
+TESSDATA_DIR = None  # Set by check_dependencies()
+_thread_state = threading.local()  # Holds each thread's Tesseract API and Hyperscan scratch space
+_apis = []  # Every API created so far, so they can all be released on shutdown
+_apis_lock = threading.Lock()
+_ocr_cache = OrderedDict()  # Image content hash -> PO number (or None), least recently used first
+_ocr_cache_lock = threading.Lock()
+FILE_SETTLE_SECONDS = 0.2  # A file whose size is unchanged over this interval is done being written
+FILE_READY_TIMEOUT_SECONDS = 60  # Give up waiting and process the file as-is after this long
+MAX_OCR_DIMENSION = 2200  # Longest image side, in pixels, handed to Tesseract
+OCR_CACHE_SIZE = 2048  # Number of recent scans whose results are remembered
+OCR_LANGUAGE = "eng"
+OCR_CHAR_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"  # PO numbers only ever use these
 
 def check_dependencies():
     """Ensure necessary external tools are installed."""
-    global TESSERACT_CMD
+    global TESSERACT_CMD, TESSDATA_DIR
     if getattr(sys, 'frozen', False):  # Running as a PyInstaller bundle
         base_path = sys._MEIPASS  # PyInstaller runtime path
         TESSERACT_CMD = os.path.join(base_path, "Tesseract-OCR", "tesseract.exe")
@@ -24,74 +64,343 @@ def check_dependencies():
         logging.error("Tesseract not found. Please install Tesseract.")
         sys.exit(1)
 
-    os.environ["TESSDATA_PREFIX"] = os.path.dirname(TESSERACT_CMD)
-    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD  # Bind pytesseract to the executable
+    tessdata_dir = os.path.join(os.path.dirname(TESSERACT_CMD), "tessdata")
+
+    # Log and exit if tessdata directory doesn't exist
+    if not os.path.exists(tessdata_dir):
+        logging.error(f"'tessdata' directory not found at: {tessdata_dir}. Ensure Tesseract OCR is installed properly.")
+        sys.exit(1)
+
+    os.environ["TESSDATA_PREFIX"] = tessdata_dir
+    TESSDATA_DIR = tessdata_dir
+
+    # Load the engine once now so a bad tessdata path or missing language fails at startup, not per scan
+    try:
+        with PyTessBaseAPI(path=TESSDATA_DIR, lang=OCR_LANGUAGE):
+            pass
+    except RuntimeError as e:
+        logging.error(f"Failed to initialize Tesseract with tessdata at {TESSDATA_DIR}: {str(e)}")
+        sys.exit(1)
 
-class POFileHandler(FileSystemEventHandler):
-    def __init__(self, parent_directory, finished_directory, error_directory):
+def replace_file(source_path, destination_path):
+    """
+    Moves a file with a single rename, falling back to shutil.move if it turns out to cross filesystems.
+    """
+    try:
+        os.replace(source_path, destination_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(source_path, destination_path)
+
+def pick_move_function(source_directory, destination_directory):
+    """
+    Picks how to move files between two directories: a plain rename when they share a filesystem.
+    """
+    if os.stat(source_directory).st_dev == os.stat(destination_directory).st_dev:
+        return replace_file
+    return shutil.move
+
+class POFileHandler(PatternMatchingEventHandler):
+    def __init__(self, parent_directory, waves_directory, finished_directory, error_directory, executor, roi=None):
+        # Only PNG files are processed; watchdog drops everything else before on_created is called
+        super().__init__(patterns=["*.png"], ignore_directories=True, case_sensitive=False)
         self.parent_directory = parent_directory
+        self.waves_directory = waves_directory
         self.finished_directory = finished_directory
         self.error_directory = error_directory
+        # Create the output directories once up front rather than checking on every file
+        os.makedirs(self.finished_directory, exist_ok=True)
+        os.makedirs(self.error_directory, exist_ok=True)
+        self._move_to_finished = pick_move_function(self.waves_directory, self.finished_directory)
+        self._move_to_error = pick_move_function(self.waves_directory, self.error_directory)
+        self.executor = executor  # OCR worker pool
+        self.roi = roi  # Region of the page to search first, as x,y,w,h fractions
 
     def on_created(self, event):
-        if not event.is_directory:
-            file_path = event.src_path
-            logging.info(f"New file detected: {file_path}")
-            
-            # Wait for the file to finish writing
-            while not os.path.exists(file_path) or (
-                os.path.isfile(file_path) and os.stat(file_path).st_size == 0
-            ):
-                logging.info(f"Waiting for file to finish writing: {file_path}")
-                time.sleep(1)
-
-            # Process PNG files only
-            if file_path.lower().endswith('.png'):
-                po_number = extract_po_number_from_image(file_path)
-                if po_number:
-                    logging.info(f"Extracted PO Number: {po_number}")
-                    self.rename_and_move(file_path, po_number)
-                else:
-                    logging.info("PO Number could not be extracted.")
-                    self.handle_no_po_numbers(file_path)
-            else:
-                logging.warning(f"Unsupported file format detected: {file_path}")
+        file_path = event.src_path
+        logging.info(f"New file detected: {file_path}")
+        # Hand the file to the OCR pool; it queues work itself when every worker is busy
+        future = self.executor.submit(ocr_file, file_path, self.roi)
+        future.add_done_callback(partial(self.on_ocr_done, os.path.basename(file_path)))
+
+    def on_ocr_done(self, file_name, future):
+        try:
+            po_number, file_path = future.result()
+        except Exception as e:
+            logging.error(f"OCR worker failed: {str(e)}")
+            return
+        self.process_file(file_path, file_name, po_number)
+
+    def process_file(self, file_path, file_name, po_number):
+        if po_number:
+            logging.info(f"Extracted PO Number: {po_number}")
+            self.rename_and_move(file_path, po_number)
+        else:
+            logging.info("PO Number could not be extracted.")
+            self.handle_no_po_numbers(file_path, file_name)
 
     def rename_and_move(self, file_path, po_number):
-        file_extension = os.path.splitext(file_path)[1]  # Get the file extension
-        new_file_name = f"{po_number}_{uuid.uuid4().hex[:6]}{file_extension}"  # Create a unique name
+        new_file_name = f"{po_number}_{token_hex(3)}.png"  # Create a unique name (only PNGs reach this handler)
         destination_path = os.path.join(self.finished_directory, new_file_name)
 
-        # Ensure finished directory exists
-        if not os.path.exists(self.finished_directory):
-            os.makedirs(self.finished_directory)
-            logging.info(f"Created finished directory: {self.finished_directory}")
-
-        shutil.move(file_path, destination_path)  # Move file to finished directory
+        self._move_to_finished(file_path, destination_path)  # Move file to finished directory
         logging.info(f"File renamed to '{new_file_name}' and moved to: {destination_path}")
 
-    def handle_no_po_numbers(self, file_path):
+    def handle_no_po_numbers(self, file_path, file_name):
         # Move files with no detectable PO numbers to an error directory
-        if not os.path.exists(self.error_directory):
-            os.makedirs(self.error_directory)
-            logging.info(f"Created error directory: {self.error_directory}")
-
-        error_file_path = os.path.join(self.error_directory, os.path.basename(file_path))
-        shutil.move(file_path, error_file_path)
+        error_file_path = os.path.join(self.error_directory, file_name)
+        self._move_to_error(file_path, error_file_path)
         logging.warning(f"File with no PO number moved to: {error_file_path}")
 
-def extract_po_number_from_image(image_path):
+def find_po_number(text):
+    """
+    Returns the first PO number in the OCR text, or None.
+    """
+    if _PO_DB is None:
+        po_number_match = _PO_RE.search(text)
+        return po_number_match.group() if po_number_match else None
+
+    data = text.encode()
+    starts = []
+
+    def on_match(pattern_id, start, end, flags, context):
+        if not starts:  # Matches are reported in order of end offset, so the first one is the leftmost
+            starts.append(start)
+
+    scratch = getattr(_thread_state, "scratch", None)
+    if scratch is None:  # Hyperscan scratch space can't be shared between threads
+        scratch = _thread_state.scratch = hyperscan.Scratch(_PO_DB)
+    _PO_DB.scan(data, match_event_handler=on_match, scratch=scratch)
+    if not starts:
+        return None
+    # Hyperscan reports the shortest match; extend it from the same start the way re.search would
+    return _PO_BYTES_RE.match(data, starts[0]).group().decode()
+
+def get_api():
+    """
+    Returns the Tesseract API for the current thread, creating it on first use.
+    """
+    api = getattr(_thread_state, "api", None)
+    if api is None:
+        # Load tessdata once per worker. PO tokens are sparse, so skip full layout analysis
+        api = PyTessBaseAPI(path=TESSDATA_DIR, lang=OCR_LANGUAGE, psm=PSM.SPARSE_TEXT)
+        api.SetVariable("tessedit_char_whitelist", OCR_CHAR_WHITELIST)
+        _thread_state.api = api
+        with _apis_lock:
+            _apis.append(api)
+    return api
+
+def release_apis():
+    """
+    Releases every Tesseract API created by the worker threads.
+    """
+    with _apis_lock:
+        for api in _apis:
+            api.End()
+        _apis.clear()
+
+def ocr_image(img):
+    """
+    Runs OCR on a PIL image using this thread's Tesseract API.
+    """
+    if img.mode != 'L':
+        img = img.convert('L')
+    # Hand Tesseract the raw 8-bit pixels; SetImage would encode the image to a file format first
+    width, height = img.size
+    api = get_api()
+    api.SetImageBytes(img.tobytes(), width, height, 1, width)
+    return api.GetUTF8Text()
+
+def otsu_threshold(histogram):
+    """
+    Picks the grey level that best separates ink from paper (Otsu's method).
+    """
+    total = sum(histogram)
+    weighted_total = sum(level * count for level, count in enumerate(histogram))
+    background_count = 0
+    background_sum = 0
+    best_threshold, best_variance = 0, 0
+    for level, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += level * count
+        background_mean = background_sum / background_count
+        foreground_mean = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = level, variance
+    return best_threshold
+
+def parse_roi(value):
+    """
+    Parses an "x,y,w,h" region of interest given as fractions of the image size.
+    """
+    try:
+        x, y, w, h = (float(part) for part in value.split(","))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ROI must be four comma-separated numbers (x,y,w,h), got: {value}")
+    # Small tolerance so e.g. 0.8 + 0.2 isn't rejected by float rounding
+    if not (0 <= x < 1 and 0 <= y < 1 and w > 0 and h > 0 and x + w <= 1 + 1e-9 and y + h <= 1 + 1e-9):
+        raise argparse.ArgumentTypeError(f"ROI must lie within the image (fractions between 0 and 1), got: {value}")
+    return x, y, w, h
+
+def crop_to_roi(img, roi):
+    """
+    Crops the image to the region of interest, so only that part of the page is OCR'd.
+    """
+    x, y, w, h = roi
+    width, height = img.size
+    left = min(int(x * width), width - 1)
+    top = min(int(y * height), height - 1)
+    # Keep at least one pixel in each direction, however small the image
+    right = min(max(int((x + w) * width), left + 1), width)
+    bottom = min(max(int((y + h) * height), top + 1), height)
+    return img.crop((left, top, right, bottom))
+
+if njit is not None:
+    # Serial on purpose: files are already spread across the OCR workers, and numba's parallel
+    # regions are not safe to enter from several threads at once. nogil lets the workers overlap.
+    # cache=True keeps the compiled kernel across restarts, but needs a writable source tree (not a PyInstaller bundle)
+    @njit(nogil=True, cache=not getattr(sys, 'frozen', False))
+    def otsu_binarize(pixels):
+        """
+        Binarizes a 2-D uint8 grayscale array at its Otsu threshold.
+        """
+        height, width = pixels.shape
+        histogram = np.zeros(256, np.int64)
+        for y in range(height):
+            for x in range(width):
+                histogram[pixels[y, x]] += 1
+
+        total = height * width
+        weighted_total = 0.0
+        for level in range(256):
+            weighted_total += level * histogram[level]
+        background_count = 0
+        background_sum = 0.0
+        threshold, best_variance = 0, 0.0
+        for level in range(256):
+            background_count += histogram[level]
+            if background_count == 0:
+                continue
+            foreground_count = total - background_count
+            if foreground_count == 0:
+                break
+            background_sum += level * histogram[level]
+            background_mean = background_sum / background_count
+            foreground_mean = (weighted_total - background_sum) / foreground_count
+            variance = background_count * foreground_count * (background_mean - foreground_mean) ** 2
+            if variance > best_variance:
+                threshold, best_variance = level, variance
+
+        binary = np.empty_like(pixels)
+        for y in range(height):
+            for x in range(width):
+                binary[y, x] = 255 if pixels[y, x] > threshold else 0
+        return binary
+else:
+    otsu_binarize = None
+
+def preprocess_image(img):
+    """
+    Shrinks and binarizes the image so Tesseract has fewer pixels to work through.
+    """
+    img = ImageOps.grayscale(img)
+    if max(img.size) > MAX_OCR_DIMENSION:  # Scans above ~200 DPI don't help OCR, they only slow it down
+        img.thumbnail((MAX_OCR_DIMENSION, MAX_OCR_DIMENSION), Image.LANCZOS)
+    if otsu_binarize is not None:
+        return Image.fromarray(otsu_binarize(np.asarray(img)))
+    threshold = otsu_threshold(img.histogram())
+    return img.point(lambda p: 255 if p > threshold else 0, mode='1')
+
+def wait_for_file(file_path):
+    """
+    Blocks until the file has stopped growing, i.e. the scanner has finished writing it.
+    Returns False if the file disappeared in the meantime.
+    """
+    deadline = time.monotonic() + FILE_READY_TIMEOUT_SECONDS
+    previous_size = -1
+    while time.monotonic() < deadline:
+        try:
+            size = os.path.getsize(file_path)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            size = -1  # Not readable yet
+        if size == previous_size and size > 0:
+            return True
+        previous_size = size
+        time.sleep(FILE_SETTLE_SECONDS)
+
+    # Still empty or still changing; let OCR try it, unreadable files end up in the error directory
+    logging.warning(f"Timed out waiting for file to finish writing: {file_path}")
+    return True
+
+def ocr_file(file_path, roi=None):
+    """
+    OCR worker job: waits for the file to be ready and extracts its PO number.
+    """
+    if not wait_for_file(file_path):
+        raise FileNotFoundError(f"File disappeared before it could be processed: {file_path}")
+    return extract_po_number_from_image(file_path, roi), file_path
+
+def lookup_cached_po_number(content_key):
+    """
+    Returns (True, po_number) if an image with this content hash was already processed.
+    """
+    with _ocr_cache_lock:
+        if content_key in _ocr_cache:
+            _ocr_cache.move_to_end(content_key)
+            return True, _ocr_cache[content_key]
+    return False, None
+
+def cache_po_number(content_key, po_number):
+    """
+    Remembers the result for an image's content hash, evicting the least recently used entries.
+    """
+    with _ocr_cache_lock:
+        _ocr_cache[content_key] = po_number
+        _ocr_cache.move_to_end(content_key)
+        while len(_ocr_cache) > OCR_CACHE_SIZE:
+            _ocr_cache.popitem(last=False)
+
+def extract_po_number_from_image(image_path, roi=None):
     """
     Extracts the Purchase Order (PO) number from a PNG image using OCR.
+    If a region of interest is given it is searched first, falling back to the whole page.
     """
     try:
-        # Perform OCR on the image
-        ocr_result = pytesseract.image_to_string(Image.open(image_path))
-        po_number_match = re.search(r'PO\d+', ocr_result)  # Look for "PO" followed by numbers using regex
+        # Read the file once; a retransmitted scan with identical content reuses the earlier result
+        with open(image_path, 'rb') as image_file:
+            data = image_file.read()
+        content_key = hashlib.blake2b(data, digest_size=16).digest()
+        cached, po_number = lookup_cached_po_number(content_key)
+
+        if cached:
+            logging.info(f"Image content already processed, skipping OCR: {image_path}")
+        else:
+            # Load the image and perform OCR on a cleaned-up copy
+            img = Image.open(io.BytesIO(data))
+            img.draft('L', (MAX_OCR_DIMENSION, MAX_OCR_DIMENSION))  # Let JPEG decode straight to reduced grayscale; no-op for PNG
+            img.load()
+            po_number = None
+            if roi:
+                try:
+                    po_number = find_po_number(ocr_image(preprocess_image(crop_to_roi(img, roi))))
+                except Exception as e:  # Still fall back to the whole page below
+                    logging.warning(f"OCR of region of interest failed for image {image_path}: {str(e)}")
+            if not po_number:
+                po_number = find_po_number(ocr_image(preprocess_image(img)))
+            cache_po_number(content_key, po_number)
 
-        if po_number_match:
-            logging.info(f"PO Number '{po_number_match.group()}' found in image: {image_path}")
-            return po_number_match.group()
+        if po_number:
+            logging.info(f"PO Number '{po_number}' found in image: {image_path}")
+            return po_number
         logging.warning(f"No PO Number found in image: {image_path}")
         return None
     except Exception as e:
@@ -107,6 +416,12 @@ if __name__ == "__main__":
         default=os.path.join(os.path.abspath(os.sep), "renamescans"),  # Default to "renamescans" in the root of the drive
         help="Root directory to house 'waves', 'wavesfinished', and 'waveserrors'. Default is root\\renamescans.",
     )
+    parser.add_argument(
+        "--roi",
+        type=parse_roi,
+        default=None,
+        help="Region of the page to search for the PO number first, as x,y,w,h fractions of the page (e.g. 0.5,0,0.5,0.25 for the top-right corner). The whole page is searched if nothing is found there.",
+    )
     args = parser.parse_args()
 
     # Define directories under the parent "renamescans" directory
@@ -130,16 +445,21 @@ if __name__ == "__main__":
             os.makedirs(folder)
 
     # Start monitoring the 'waves' directory
-    event_handler = POFileHandler(parent_directory, finished_directory, error_directory)
+    executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="ocr")
+    event_handler = POFileHandler(parent_directory, waves_directory, finished_directory, error_directory, executor, args.roi)
     observer = Observer()
     observer.schedule(event_handler, path=waves_directory, recursive=False)
 
     try:
         logging.info(f"Monitoring directory: {waves_directory}")
         observer.start()  # Start monitoring
-        while True:
-            time.sleep(1)  # Keep the script running
+        # Keep the script running; a timed join so Ctrl+C can still interrupt it on Windows
+        while observer.is_alive():
+            observer.join(1)
     except KeyboardInterrupt:
         logging.info("Stopping directory monitoring.")
         observer.stop()
+        observer.join()  # No new files are submitted once the observer has stopped
+        executor.shutdown(wait=True)  # Let in-flight OCR finish before releasing the engines
+        release_apis()
     observer.join()